@@ -1,26 +1,177 @@
+import ast
 import csv
+import heapq
 import os
-from collections import defaultdict
+import pickle
+import tempfile
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from dataclasses import dataclass, field
 from datetime import datetime
-from statistics import mean
+from itertools import chain, islice
+from typing import Iterable, Iterator, Optional
 
-import git
-from radon.complexity import cc_visit
-from radon.metrics import mi_visit
+import numpy as np
+import pygit2
+import radon
+from radon.metrics import h_visit_ast, mi_compute
 from radon.raw import analyze
+from radon.visitors import ComplexityVisitor
+
+METRICS_CACHE_FILE = os.path.join(
+    os.path.expanduser("~"), ".cache", "code_quality_inspector", "metrics.pkl"
+)
+# Bump when the way metrics are computed or cached changes
+METRICS_CACHE_VERSION = 1
+EXCLUDED_DIRECTORIES = ("node_modules", "vendor", "venv", ".venv")
+METRICS_BATCH_SIZE = 16
+MAX_PENDING_BATCHES = 16
+
+
+def _calculate_metrics(file_content: str, file_name: str) -> tuple:
+    # Same as cc_visit, mi_visit and analyze, but parsing and tokenizing the
+    # source only once
+    try:
+        ast_node = ast.parse(file_content)
+        raw = analyze(file_content)
+
+        complexity_visitor = ComplexityVisitor.from_ast(ast_node)
+        cyclomatic_complexity_visit = complexity_visitor.blocks
+        num_blocks = len(cyclomatic_complexity_visit)
+        if num_blocks:
+            cyclomatic_complexity = (
+                sum(x.complexity for x in cyclomatic_complexity_visit) / num_blocks
+            )
+        else:
+            cyclomatic_complexity = 0
+
+        comments_lines = raw.comments + raw.multi
+        comments = comments_lines / float(raw.sloc) * 100 if raw.sloc != 0 else 0
+        maintainability = mi_compute(
+            h_visit_ast(ast_node).total.volume,
+            complexity_visitor.total_complexity,
+            raw.lloc,
+            comments,
+        )
+        num_lines_of_code = raw.loc
+
+    except Exception as err:
+        print("Error in {}: {}".format(file_name, err))
+        cyclomatic_complexity = 0
+        maintainability = 0
+        num_lines_of_code = 0
+
+    return cyclomatic_complexity, maintainability, num_lines_of_code
+
+
+def _calculate_metrics_batch(jobs: list) -> list:
+    return [
+        _calculate_metrics(file_content, file_name) for file_content, file_name in jobs
+    ]
+
+
+def _batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _format_date(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _format_metric(value: float, lines_of_code: int):
+    # Files that could not be analyzed and averages over no lines of code
+    # are written as integer zeros
+    return 0 if lines_of_code == 0 and value == 0 else value
+
+
+def _format_file_complexity(value: float):
+    # The complexity of a file is the mean of whole numbers, which is written
+    # as an integer when it is whole
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+@dataclass
+class Metrics:
+    """Code quality metrics stored column by column, one entry per row. The File and
+    Date columns are only filled for the tables that have them, and per_file marks
+    the tables holding the metrics of single files."""
+
+    ciclomatic_complexity: array = field(default_factory=lambda: array("d"))
+    maintainability: array = field(default_factory=lambda: array("d"))
+    lines_of_code: array = field(default_factory=lambda: array("q"))
+    date: array = field(default_factory=lambda: array("q"))
+    file: list = field(default_factory=list)
+    per_file: bool = False
+
+    def append(
+        self,
+        ciclomatic_complexity: float,
+        maintainability: float,
+        lines_of_code: int,
+        date: Optional[int] = None,
+        file: Optional[str] = None,
+    ) -> None:
+        self.ciclomatic_complexity.append(ciclomatic_complexity)
+        self.maintainability.append(maintainability)
+        self.lines_of_code.append(lines_of_code)
+
+        if date is not None:
+            self.date.append(date)
+        if file is not None:
+            self.file.append(file)
+
+    def rows(self, fieldnames: list) -> Iterator[tuple]:
+        if self.per_file:
+            ciclomatic_complexity = map(
+                _format_file_complexity, self.ciclomatic_complexity
+            )
+        else:
+            ciclomatic_complexity = map(
+                _format_metric, self.ciclomatic_complexity, self.lines_of_code
+            )
+        columns = {
+            "File": self.file,
+            "Date": map(_format_date, self.date),
+            "Ciclomatic_Complexity": ciclomatic_complexity,
+            "Maintainability": map(
+                _format_metric, self.maintainability, self.lines_of_code
+            ),
+            "Lines_of_Code": self.lines_of_code,
+        }
+
+        return zip(*(columns[fieldname] for fieldname in fieldnames))
 
 
 class CodeQualityInspector:
     """A class for inspecting and analyzing code quality metrics for a software project, which includes
     metrics such as cyclomatic complexity, maintainability, and lines of code."""
 
-    def __init__(self, project_directory: str) -> None:
+    def __init__(
+        self,
+        project_directory: str,
+        metrics_cache_file: Optional[str] = METRICS_CACHE_FILE,
+        excluded_directories: Iterable[str] = EXCLUDED_DIRECTORIES,
+    ) -> None:
         self._project_directory = project_directory
+        self._metrics_cache_file = metrics_cache_file
+        self._excluded_directories = frozenset(excluded_directories)
 
-        self._metrics: list = []
-        self._metrics_by_file: list = []
-        self._history_metrics: list = []
-        self._history_metrics_by_file: dict = {}
+        self._metrics = Metrics()
+        self._metrics_by_file = Metrics(per_file=True)
+        self._history_metrics = Metrics()
+        self._history_runs_by_file: dict = {}
+        self._history_commit_dates = array("q")
+        self._blob_metrics_cache: dict = {}
 
     def inspect_project(
         self, inspect_history: bool = False, max_history_count: int = 0
@@ -35,7 +186,11 @@ class CodeQualityInspector:
                 If provided, only the most recent 'max_history_count' data points will be analyzed.
                 If not provided, all available historical data will be considered. Defaults to 0.
 
-        Note: Inspecting the history of a large project can be time-consuming.
+        Note: The current metrics are computed from the files in the project directory,
+        skipping the ones ignored by git. Directories named in 'excluded_directories'
+        are skipped both there and in the history. Results for unchanged files are
+        cached in 'metrics_cache_file', pass None to the constructor to disable the
+        cache. Inspecting the history of a large project can be time-consuming.
 
         Returns:
             None
@@ -46,134 +201,469 @@ class CodeQualityInspector:
 
         if inspect_history:
             max_count = max_history_count if max_history_count > 0 else None
-            self._history_metrics_by_file = self._generate_history_metrics_by_file(
-                max_count=max_count
-            )
+            (
+                self._history_runs_by_file,
+                self._history_commit_dates,
+            ) = self._generate_history_runs_by_file(max_count=max_count)
             self._generate_history_metrics()
 
-    def _generate_history_metrics_by_file(self, max_count):
-        history_metrics_by_file = defaultdict(list)
+    def _generate_history_runs_by_file(self, max_count):
+        # The history of a file is kept as runs of consecutive commits holding
+        # the same blob, so memory grows with the number of file versions and
+        # not with the number of commits times the number of files
+        history_runs_by_file: dict = defaultdict(list)
+        commit_dates = array("q")
+
+        # Git access stays in this process and the metrics are computed by the
+        # workers while the walk goes on
+        pending_blobs = self._walk_history(
+            max_count, history_runs_by_file, commit_dates
+        )
+        self._blob_metrics_cache.update(self._calculate_pending_metrics(pending_blobs))
+
+        # Empty files have no metrics and therefore no history
+        measured_runs_by_file = {}
+        for file_name, runs in history_runs_by_file.items():
+            runs = [run for run in runs if self._blob_metrics_cache[run[1]] is not None]
+            if runs:
+                measured_runs_by_file[file_name] = runs
+
+        return measured_runs_by_file, commit_dates
+
+    def _walk_history(self, max_count, history_runs_by_file, commit_dates):
+        open_runs: dict = {}
+        previous_tree = None
+
+        repo = pygit2.Repository(self._project_directory)
+        odb = repo.odb
+        # Without a sort flag the commits are streamed from HEAD in the same
+        # order as git rev-list, instead of sorting the whole graph first
+        commits = repo.walk(repo.head.target, pygit2.GIT_SORT_NONE)
+
+        for count, commit in enumerate(commits):
+            if max_count is not None and count >= max_count:
+                break
+
+            commit_dates.append(commit.commit_time)
+
+            # Only the blobs that changed since the previously visited commit
+            # need to be looked at, the rest are carried forward. Commits that
+            # share the previous tree, such as empty commits or merges that
+            # kept one side, have nothing to diff
+            if previous_tree is None:
+                changes = self._iter_python_blobs(commit.tree)
+            elif commit.tree_id == previous_tree.id:
+                continue
+            else:
+                changes = self._iter_tree_changes(previous_tree, commit.tree)
+            previous_tree = commit.tree
+
+            for path, blob_id in changes:
+                file_name = os.path.splitext(os.path.basename(path))[0]
+                if file_name == "__init__":
+                    continue
+
+                if path in open_runs:
+                    run_blob_id, run_start = open_runs.pop(path)
+                    history_runs_by_file[file_name].append(
+                        (path, run_blob_id, run_start, count)
+                    )
 
-        repo = git.Repo(self._project_directory)
-        commits = repo.iter_commits(max_count=max_count)
+                if blob_id is None:
+                    continue
 
-        for commit in commits:
-            for item in commit.tree.traverse():
-                if item.type == "blob" and item.path.endswith(".py"):
-                    file_date = datetime.fromtimestamp(commit.committed_date).strftime(
-                        "%Y-%m-%d %H:%M:%S"
-                    )
-                    file_name = os.path.splitext(item.name)[0]
-                    file_content = repo.git.show(f"{commit.hexsha}:{item.path}")
+                open_runs[path] = (blob_id, count)
 
-                    if len(file_content) == 0 or file_name == "__init__":
-                        continue
+                # Blobs are immutable, so metrics cached under their id stay
+                # valid across commits and across calls
+                if blob_id not in self._blob_metrics_cache:
+                    self._blob_metrics_cache[blob_id] = None
+                    _, file_data = odb.read(blob_id)
+                    file_content = file_data.decode("utf-8", "replace")
+                    if len(file_content) > 0:
+                        yield blob_id, file_content, file_name
 
-                    metrics = self._calculate_metrics(file_content, file_name)
-                    metrics["Date"] = file_date
+        for path, (run_blob_id, run_start) in open_runs.items():
+            file_name = os.path.splitext(os.path.basename(path))[0]
+            history_runs_by_file[file_name].append(
+                (path, run_blob_id, run_start, len(commit_dates))
+            )
 
-                    history_metrics_by_file[file_name].append(metrics)
+    def _iter_python_blobs(self, tree):
+        pending = deque([("", tree)])
 
-        return history_metrics_by_file
+        while pending:
+            directory, tree = pending.popleft()
 
-    def _generate_history_metrics(self):
-        metrics_by_date = defaultdict(list)
+            for entry in tree:
+                path = f"{directory}{entry.name}"
 
-        for metrics_by_file in self._history_metrics_by_file.values():
-            for metrics in metrics_by_file:
-                metrics_by_date[metrics["Date"]].append(metrics)
+                if entry.type_str == "tree":
+                    if entry.name not in self._excluded_directories:
+                        pending.append((f"{path}/", entry))
+                elif entry.type_str == "blob" and entry.name.endswith(".py"):
+                    yield path, entry.id
 
-        sorted_dates = sorted(metrics_by_date.keys(), reverse=True)
+    def _iter_tree_changes(self, old_tree, new_tree):
+        # Renames are not detected, so old and new paths of a delta are the same
+        for delta in old_tree.diff_to_tree(new_tree).deltas:
+            path = delta.new_file.path
 
-        for date in sorted_dates:
-            date_metrics = metrics_by_date[date]
-            total_ciclomatic = 0.0
-            total_maintainability = 0.0
-            total_loc = 0
+            if not path.endswith(".py") or self._is_excluded(path):
+                continue
 
-            for metrics in date_metrics:
-                total_ciclomatic += (
-                    metrics["Ciclomatic_Complexity"] * metrics["Lines_of_Code"]
-                )
-                total_maintainability += (
-                    metrics["Maintainability"] * metrics["Lines_of_Code"]
-                )
-                total_loc += metrics["Lines_of_Code"]
+            if delta.status == pygit2.GIT_DELTA_DELETED or (
+                delta.new_file.mode == pygit2.GIT_FILEMODE_COMMIT
+            ):
+                yield path, None
+            else:
+                yield path, delta.new_file.id
+
+    def _is_excluded(self, path):
+        directories = path.split("/")[:-1]
+        return not self._excluded_directories.isdisjoint(directories)
 
-            weighted_avg_ciclomatic = total_ciclomatic / total_loc if total_loc else 0
-            weighted_avg_maintainability = (
-                total_maintainability / total_loc if total_loc else 0
+    def _generate_history_metrics(self):
+        starts = array("q")
+        ends = array("q")
+        ciclomatic = array("d")
+        maintainability = array("d")
+        loc = array("q")
+
+        for runs in self._history_runs_by_file.values():
+            for _, blob_id, start, end in runs:
+                blob_metrics = self._blob_metrics_cache[blob_id]
+                starts.append(start)
+                ends.append(end)
+                ciclomatic.append(blob_metrics[0])
+                maintainability.append(blob_metrics[1])
+                loc.append(blob_metrics[2])
+
+        # A history without any measured file has no dates to report
+        if not starts:
+            return
+
+        num_commits = len(self._history_commit_dates)
+        starts_array = np.asarray(starts, dtype=np.intp)
+        ends_array = np.asarray(ends, dtype=np.intp)
+
+        # Group the commits by date, numbering the dates in the order the
+        # commits were visited, and reduce every group at once
+        date_ids: dict = {}
+        commit_date_ids = np.fromiter(
+            (
+                date_ids.setdefault(date, len(date_ids))
+                for date in self._history_commit_dates
+            ),
+            dtype=np.intp,
+            count=num_commits,
+        )
+        num_dates = len(date_ids)
+
+        def sum_by_date(weights):
+            # Every run adds its weight from its first commit up to its last
+            # one. Floats are fractions with a power of two denominator, so
+            # scaled by the largest one they become integers whose sums are
+            # exact, and no rounding residue of one run is left in the totals
+            # of another. The totals are returned with their scale, so that an
+            # average is rounded only once, when it is divided by both at once
+            ratios = [weight.as_integer_ratio() for weight in weights]
+            scale = max(denominator for _, denominator in ratios)
+            exact_weights = np.array(
+                [
+                    numerator * (scale // denominator)
+                    for numerator, denominator in ratios
+                ],
+                dtype=object,
             )
 
+            changes = np.zeros(num_commits + 1, dtype=object)
+            np.add.at(changes, starts_array, exact_weights)
+            np.subtract.at(changes, ends_array, exact_weights)
+
+            totals = np.zeros(num_dates, dtype=object)
+            np.add.at(totals, commit_date_ids, np.cumsum(changes[:num_commits]))
+            return totals.tolist(), scale
+
+        date_rows, _ = sum_by_date([1] * len(loc))
+        total_loc, _ = sum_by_date(loc)
+        total_ciclomatic, ciclomatic_scale = sum_by_date(
+            [value * lines for value, lines in zip(ciclomatic, loc)]
+        )
+        total_maintainability, maintainability_scale = sum_by_date(
+            [value * lines for value, lines in zip(maintainability, loc)]
+        )
+
+        weighted_avg_ciclomatic = [
+            total / (ciclomatic_scale * date_loc) if date_loc else 0
+            for total, date_loc in zip(total_ciclomatic, total_loc)
+        ]
+        weighted_avg_maintainability = [
+            total / (maintainability_scale * date_loc) if date_loc else 0
+            for total, date_loc in zip(total_maintainability, total_loc)
+        ]
+
+        # Dates are listed newest first. The walk follows the commit graph, so
+        # commits with skewed dates are not visited in date order
+        for date in sorted(date_ids, reverse=True):
+            date_id = date_ids[date]
+
+            # Commits without any measured file have no metrics to report
+            if date_rows[date_id] == 0:
+                continue
+
             self._history_metrics.append(
-                {
-                    "Date": date,
-                    "Ciclomatic_Complexity": weighted_avg_ciclomatic,
-                    "Maintainability": weighted_avg_maintainability,
-                    "Lines_of_Code": total_loc,
-                }
+                weighted_avg_ciclomatic[date_id],
+                weighted_avg_maintainability[date_id],
+                total_loc[date_id],
+                date=date,
+            )
+
+    def _iter_history_metrics_of_file(self, runs, commit_dates):
+        # Files sharing a name are listed in tree order within each commit.
+        # The runs of a path are kept in commit order and never overlap, so
+        # every path is already a sorted stream of rows and the streams are
+        # merged lazily, without holding the rows of the file in memory
+        runs_by_path = defaultdict(list)
+        for run in runs:
+            runs_by_path[run[0]].append(run)
+
+        streams = [
+            self._iter_history_metrics_of_path(path, path_runs)
+            for path, path_runs in runs_by_path.items()
+        ]
+        for commit, _, blob_metrics in heapq.merge(*streams, key=lambda row: row[:2]):
+            yield (commit_dates[commit], *blob_metrics)
+
+    def _iter_history_metrics_of_path(self, path, runs):
+        tree_order = (path.count("/"), path.split("/"))
+
+        for _, blob_id, start, end in runs:
+            ciclomatic, maintainability, loc = self._blob_metrics_cache[blob_id]
+            blob_metrics = (
+                _format_file_complexity(ciclomatic),
+                _format_metric(float(maintainability), loc),
+                loc,
             )
+            for commit in range(start, end):
+                yield commit, tree_order, blob_metrics
 
     def _generate_project_metrics_by_file(self):
-        history_metrics_by_file = self._generate_history_metrics_by_file(max_count=1)
+        metrics_cache = self._load_metrics_cache()
+        metrics_by_key = {}
+        blob_ids_by_key = {}
+        worktree = []
+        pending_files = []
+
+        project_directory = os.path.abspath(self._project_directory)
+        try:
+            repo = pygit2.Repository(project_directory)
+        except pygit2.GitError:
+            repo = None
+
+        # Files are dated by the commit checked out, like the history. The
+        # modification time is only used outside of a repository with commits
+        head_date = None
+        if repo is not None and not repo.head_is_unborn:
+            head_date = repo.head.peel(pygit2.Commit).commit_time
+
+        for path, stat in self._iter_python_files(project_directory, repo):
+            file_name = os.path.splitext(os.path.basename(path))[0]
+            if file_name == "__init__":
+                continue
+
+            file_date = head_date if head_date is not None else int(stat.st_mtime)
+
+            # Files whose path, modification time and size did not change
+            # since the last run are not read again
+            key = (path, stat.st_mtime_ns, stat.st_size)
+            if key in metrics_cache:
+                metrics_by_key[key] = metrics_cache[key]
+            else:
+                with open(path, "rb") as file:
+                    file_data = file.read()
+
+                # Hashing the content as a git blob shares the metrics with
+                # any commit holding the same file version
+                blob_id = pygit2.hash(file_data)
+                blob_ids_by_key[key] = blob_id
+
+                if blob_id not in self._blob_metrics_cache:
+                    self._blob_metrics_cache[blob_id] = None
+                    file_content = file_data.decode("utf-8", "replace")
+                    if len(file_content) > 0:
+                        pending_files.append((blob_id, file_content, file_name))
+
+            worktree.append((file_name, file_date, key))
+
+        self._blob_metrics_cache.update(self._calculate_pending_metrics(pending_files))
+        for key, blob_id in blob_ids_by_key.items():
+            metrics_by_key[key] = self._blob_metrics_cache[blob_id]
+        self._save_metrics_cache(metrics_cache, metrics_by_key)
+
+        seen_files = set()
+        for file_name, file_date, key in worktree:
+            file_metrics = metrics_by_key[key]
+            if file_metrics is None or file_name in seen_files:
+                continue
+
+            seen_files.add(file_name)
+            self._metrics_by_file.append(*file_metrics, date=file_date, file=file_name)
+
+    def _iter_python_files(self, project_directory, repo):
+        # Ignore rules are matched against paths relative to the root of the
+        # repository, which can be above the project directory
+        if repo is None or repo.workdir is None:
+            repo = None
+            prefix = ""
+        else:
+            prefix = os.path.relpath(
+                os.path.realpath(project_directory), os.path.realpath(repo.workdir)
+            )
+            prefix = "" if prefix == "." else f"{prefix.replace(os.sep, '/')}/"
 
-        for file_name, file_metrics in history_metrics_by_file.items():
-            metrics = file_metrics[0]
-            metrics["File"] = file_name
-            self._metrics_by_file.append(metrics)
+        pending = deque([project_directory])
 
-    def _generate_project_metrics(self):
-        total_ciclomatic = 0.0
-        total_maintainability = 0.0
-        total_loc = 0
+        while pending:
+            directory = pending.popleft()
+
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+
+            for entry in entries:
+                # Hidden files are analyzed as they are in the history, only
+                # the metadata of the repository itself is skipped
+                if entry.name == ".git":
+                    continue
+
+                relative_path = os.path.relpath(entry.path, project_directory)
+                relative_path = prefix + relative_path.replace(os.sep, "/")
 
-        for metrics in self._metrics_by_file:
-            total_ciclomatic += (
-                metrics["Ciclomatic_Complexity"] * metrics["Lines_of_Code"]
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in self._excluded_directories:
+                        continue
+                    if repo is None or not repo.path_is_ignored(f"{relative_path}/"):
+                        pending.append(entry.path)
+                elif entry.is_file() and entry.name.endswith(".py"):
+                    if repo is None or not repo.path_is_ignored(relative_path):
+                        yield entry.path, entry.stat()
+
+    def _load_metrics_cache(self):
+        if self._metrics_cache_file is None:
+            return {}
+
+        # Unpickling a damaged or foreign file can raise almost anything, and
+        # any such file is treated as a missing cache
+        try:
+            with open(self._metrics_cache_file, "rb") as file:
+                metrics_cache = pickle.load(file)
+        except Exception:
+            return {}
+
+        # Entries written by other metric code or another radon version would
+        # not match what is computed now
+        if (
+            not isinstance(metrics_cache, dict)
+            or metrics_cache.get("version") != self._metrics_cache_version()
+            or not isinstance(metrics_cache.get("metrics"), dict)
+        ):
+            return {}
+
+        return metrics_cache["metrics"]
+
+    @staticmethod
+    def _metrics_cache_version():
+        return (METRICS_CACHE_VERSION, radon.__version__)
+
+    def _save_metrics_cache(self, metrics_cache, metrics_by_key):
+        if self._metrics_cache_file is None:
+            return
+
+        # Drop the entries of files of this project that no longer exist or
+        # have changed, keep the ones of other projects
+        project_directory = os.path.join(os.path.abspath(self._project_directory), "")
+        metrics_cache = {
+            key: metrics
+            for key, metrics in metrics_cache.items()
+            if not key[0].startswith(project_directory)
+        }
+        metrics_cache.update(metrics_by_key)
+
+        # The cache is written to a temporary file that then replaces it, so
+        # runs going on at the same time never truncate each other's cache
+        cache = {"version": self._metrics_cache_version(), "metrics": metrics_cache}
+        temporary_path = None
+        try:
+            cache_directory = os.path.dirname(os.path.abspath(self._metrics_cache_file))
+            os.makedirs(cache_directory, exist_ok=True)
+            file_descriptor, temporary_path = tempfile.mkstemp(
+                dir=cache_directory, suffix=".tmp"
             )
-            total_maintainability += (
-                metrics["Maintainability"] * metrics["Lines_of_Code"]
+            with os.fdopen(file_descriptor, "wb") as file:
+                pickle.dump(cache, file)
+            os.replace(temporary_path, self._metrics_cache_file)
+        except OSError as err:
+            print("Error writing {}: {}".format(self._metrics_cache_file, err))
+            if temporary_path is not None and os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def _calculate_pending_metrics(self, pending):
+        batches = (
+            (
+                [key for key, _, _ in batch],
+                [(file_content, file_name) for _, file_content, file_name in batch],
             )
-            total_loc += metrics["Lines_of_Code"]
+            for batch in _batched(pending, METRICS_BATCH_SIZE)
+        )
 
-        weighted_avg_ciclomatic = total_ciclomatic / total_loc if total_loc else 0
+        # A single batch is analyzed in this process, since starting workers
+        # would cost more than the analysis itself
+        first_batches = list(islice(batches, MAX_PENDING_BATCHES))
+        if len(first_batches) <= 1:
+            for keys, jobs in first_batches:
+                yield from zip(keys, _calculate_metrics_batch(jobs))
+            return
+
+        # Batches are handed to the workers as soon as they are read, so the
+        # reading overlaps with the analysis. The number of batches in flight
+        # is bounded to keep the file contents waiting in memory bounded too,
+        # and no more workers are started than there are batches to share
+        max_workers = min(os.cpu_count() or 1, len(first_batches))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            running: dict = {}
+
+            for keys, jobs in chain(first_batches, batches):
+                if len(running) >= MAX_PENDING_BATCHES:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from zip(running.pop(future), future.result())
+
+                running[executor.submit(_calculate_metrics_batch, jobs)] = keys
+
+            for future in as_completed(running):
+                yield from zip(running[future], future.result())
+
+    def _generate_project_metrics(self):
+        ciclomatic = np.asarray(self._metrics_by_file.ciclomatic_complexity)
+        maintainability = np.asarray(self._metrics_by_file.maintainability)
+        loc = np.asarray(self._metrics_by_file.lines_of_code, dtype=float)
+
+        # The weighted totals are accumulated left to right, file by file, so
+        # they round exactly like a plain running sum would
+        total_loc = int(loc.sum())
+        total_ciclomatic = np.cumsum(ciclomatic * loc)[-1] if total_loc else 0
+        total_maintainability = np.cumsum(maintainability * loc)[-1] if total_loc else 0
+        weighted_avg_ciclomatic = (
+            float(total_ciclomatic) / total_loc if total_loc else 0
+        )
         weighted_avg_maintainability = (
-            total_maintainability / total_loc if total_loc else 0
+            float(total_maintainability) / total_loc if total_loc else 0
         )
 
         self._metrics.append(
-            {
-                "Ciclomatic_Complexity": weighted_avg_ciclomatic,
-                "Maintainability": weighted_avg_maintainability,
-                "Lines_of_Code": total_loc,
-            }
+            weighted_avg_ciclomatic, weighted_avg_maintainability, total_loc
         )
 
-    def _calculate_metrics(self, file_content: str, file_name: str) -> dict:
-        try:
-            cyclomatic_complexity_visit = cc_visit(file_content)
-            if len(cyclomatic_complexity_visit):
-                cyclomatic_complexity = mean(
-                    x.complexity for x in cyclomatic_complexity_visit
-                )
-            else:
-                cyclomatic_complexity = 0
-            maintainability = mi_visit(file_content, multi=True)
-            raw = analyze(file_content)
-            num_lines_of_code = raw.loc
-
-        except Exception as err:
-            print("Error in {}: {}".format(file_name, err))
-            cyclomatic_complexity = 0
-            maintainability = 0
-            num_lines_of_code = 0
-
-        return {
-            "Ciclomatic_Complexity": cyclomatic_complexity,
-            "Maintainability": maintainability,
-            "Lines_of_Code": num_lines_of_code,
-        }
-
     def write_metrics_to_csv(self, output_directory: str):
         """
         Writes the collected code quality metrics to CSV files in the specified output directory.
@@ -220,23 +710,31 @@ class CodeQualityInspector:
             self._metrics_by_file,
         )
 
-        # Write history files metrics
-        for file_name, file_metrics in self._history_metrics_by_file.items():
-            result_file_name = f"{file_name}.csv"
-            result_file_path = os.path.join(
-                output_history_files_directory, result_file_name
-            )
+        # Write history files metrics, the files are independent so their
+        # writes are overlapped in a thread pool. Rows are streamed from the
+        # runs of the file being written
+        commit_dates = [_format_date(date) for date in self._history_commit_dates]
 
-            self._write_to_csv(
-                result_file_path,
-                [
-                    "Date",
-                    "Ciclomatic_Complexity",
-                    "Maintainability",
-                    "Lines_of_Code",
-                ],
-                file_metrics,
-            )
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = []
+
+            for file_name, runs in self._history_runs_by_file.items():
+                result_file_name = f"{file_name}.csv"
+                result_file_path = os.path.join(
+                    output_history_files_directory, result_file_name
+                )
+
+                futures.append(
+                    executor.submit(
+                        self._write_history_file_to_csv,
+                        result_file_path,
+                        runs,
+                        commit_dates,
+                    )
+                )
+
+            for future in futures:
+                future.result()
 
         # Write history metrics
         self._write_to_csv(
@@ -250,8 +748,25 @@ class CodeQualityInspector:
             self._history_metrics,
         )
 
-    def _write_to_csv(self, path, fieldnames, content):
-        with open(path, "w", newline="") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(content)
+    def _write_history_file_to_csv(self, path, runs, commit_dates):
+        self._write_rows_to_csv(
+            path,
+            [
+                "Date",
+                "Ciclomatic_Complexity",
+                "Maintainability",
+                "Lines_of_Code",
+            ],
+            self._iter_history_metrics_of_file(runs, commit_dates),
+        )
+
+    def _write_to_csv(self, path, fieldnames, metrics):
+        # Rows are streamed straight from the metric columns
+        self._write_rows_to_csv(path, fieldnames, metrics.rows(fieldnames))
+
+    def _write_rows_to_csv(self, path, fieldnames, rows):
+        # A large buffer keeps the number of write calls low for long histories
+        with open(path, "w", newline="", buffering=1 << 20) as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(fieldnames)
+            writer.writerows(rows)
@@ -0,0 +1,263 @@
+import os
+import subprocess
+from datetime import datetime
+
+import pytest
+
+from code_quality_inspector.code_quality_inspector import CodeQualityInspector
+
+BASE_TIME = 1_700_000_000
+
+CLAMP = """\
+def clamp(value, low, high):
+    if value < low:
+        return low
+    if value > high:
+        return high
+    return value
+"""
+
+DOUBLE = """\
+def double(value):
+    return value * 2
+"""
+
+MAIN = """\
+from a.util import clamp
+
+
+def main(values):
+    return [clamp(value, 0, 10) for value in values]
+"""
+
+MAIN_WITH_FILTER = """\
+from a.util import clamp
+
+
+def main(values):
+    result = []
+    for value in values:
+        if value is None:
+            continue
+        result.append(clamp(value, 0, 10))
+    return result
+"""
+
+OLD = """\
+def old(value):
+    return value
+"""
+
+FEATURE = """\
+def feature(value):
+    if value:
+        return 1
+    return 0
+"""
+
+
+def _date(offset: int) -> str:
+    return datetime.fromtimestamp(BASE_TIME + offset).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _git(directory, *args, offset=0):
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="Test",
+        GIT_AUTHOR_EMAIL="test@example.com",
+        GIT_COMMITTER_NAME="Test",
+        GIT_COMMITTER_EMAIL="test@example.com",
+        GIT_AUTHOR_DATE=f"@{BASE_TIME + offset} +0000",
+        GIT_COMMITTER_DATE=f"@{BASE_TIME + offset} +0000",
+        GIT_CONFIG_NOSYSTEM="1",
+        GIT_CONFIG_GLOBAL=os.devnull,
+    )
+    subprocess.run(
+        ["git", *args], cwd=directory, env=env, check=True, stdout=subprocess.DEVNULL
+    )
+
+
+def _write(directory, path, content):
+    path = os.path.join(directory, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content)
+
+
+def _read_csv(path):
+    with open(path) as file:
+        return file.read().splitlines()
+
+
+@pytest.fixture
+def project_directory(tmp_path):
+    """A repository with same-named files in two directories, an empty file, a
+    deleted file, a merge and commits dated before their parents."""
+    directory = str(tmp_path / "project")
+    os.makedirs(directory)
+    _git(directory, "init", "-q", "-b", "main")
+
+    _write(directory, "a/util.py", CLAMP)
+    _write(directory, "b/util.py", DOUBLE)
+    _write(directory, "main.py", MAIN)
+    _write(directory, "empty.py", "")
+    _write(directory, "old.py", OLD)
+    _write(directory, "pkg/__init__.py", "VERSION = 1\n")
+    _git(directory, "add", "-A")
+    _git(directory, "commit", "-q", "-m", "Add modules", offset=100)
+
+    _write(directory, "main.py", MAIN_WITH_FILTER)
+    _git(directory, "commit", "-q", "-am", "Filter values", offset=300)
+
+    # The feature branch is dated before the commit it starts from
+    _git(directory, "checkout", "-q", "-b", "feature")
+    _write(directory, "feature.py", FEATURE)
+    _git(directory, "add", "-A")
+    _git(directory, "commit", "-q", "-m", "Add feature", offset=200)
+
+    _git(directory, "checkout", "-q", "main")
+    _git(directory, "rm", "-q", "old.py")
+    _git(directory, "commit", "-q", "-m", "Remove old", offset=400)
+    _git(
+        directory,
+        "merge",
+        "-q",
+        "--no-ff",
+        "-m",
+        "Merge feature",
+        "feature",
+        offset=500,
+    )
+
+    # HEAD is an empty commit dated before its parents
+    _git(directory, "commit", "-q", "--allow-empty", "-m", "Empty", offset=250)
+
+    return directory
+
+
+def _inspect(project_directory, output_directory, **kwargs):
+    inspector = CodeQualityInspector(project_directory, metrics_cache_file=None)
+    inspector.inspect_project(**kwargs)
+    inspector.write_metrics_to_csv(str(output_directory))
+    return str(output_directory)
+
+
+HEADER = "Date,Ciclomatic_Complexity,Maintainability,Lines_of_Code"
+
+METRICS = [
+    "Ciclomatic_Complexity,Maintainability,Lines_of_Code",
+    "2.8,79.96107431302849,20",
+]
+
+METRICS_BY_FILE = [
+    "File,Date,Ciclomatic_Complexity,Maintainability,Lines_of_Code",
+    f"feature,{_date(250)},2,100.0,4",
+    f"main,{_date(250)},3,75.15517382051522,10",
+    f"util,{_date(250)},3,74.61162467590292,6",
+]
+
+
+def test_inspect_project_without_history(project_directory, tmp_path):
+    output_directory = _inspect(project_directory, tmp_path / "output")
+
+    assert _read_csv(os.path.join(output_directory, "metrics.csv")) == METRICS
+    assert (
+        _read_csv(os.path.join(output_directory, "metrics_by_file.csv"))
+        == METRICS_BY_FILE
+    )
+    assert _read_csv(os.path.join(output_directory, "history_metrics.csv")) == [HEADER]
+    assert os.listdir(os.path.join(output_directory, "files_history")) == []
+
+
+def test_inspect_project_with_history(project_directory, tmp_path):
+    output_directory = _inspect(
+        project_directory, tmp_path / "output", inspect_history=True
+    )
+    files_history_directory = os.path.join(output_directory, "files_history")
+
+    assert _read_csv(os.path.join(output_directory, "metrics.csv")) == METRICS
+    assert (
+        _read_csv(os.path.join(output_directory, "metrics_by_file.csv"))
+        == METRICS_BY_FILE
+    )
+
+    # Dates are listed newest first, whatever the order of the commits
+    assert _read_csv(os.path.join(output_directory, "history_metrics.csv")) == [
+        HEADER,
+        f"{_date(500)},2.6363636363636362,80.74256707262148,22",
+        f"{_date(400)},2.7777777777777777,76.46313753320405,18",
+        f"{_date(300)},2.6,78.81682377988363,20",
+        f"{_date(250)},2.6363636363636362,80.74256707262148,22",
+        f"{_date(200)},2.5,82.34735314990303,24",
+        f"{_date(100)},2.1333333333333333,88.3189824928347,15",
+    ]
+
+    # Empty files and __init__ modules are not measured
+    assert sorted(os.listdir(files_history_directory)) == [
+        "feature.csv",
+        "main.csv",
+        "old.csv",
+        "util.csv",
+    ]
+
+    # Files are listed in the order their commits are visited from HEAD
+    assert _read_csv(os.path.join(files_history_directory, "feature.csv")) == [
+        HEADER,
+        f"{_date(250)},2,100.0,4",
+        f"{_date(500)},2,100.0,4",
+        f"{_date(200)},2,100.0,4",
+    ]
+    assert _read_csv(os.path.join(files_history_directory, "main.csv")) == [
+        HEADER,
+        f"{_date(250)},3,75.15517382051522,10",
+        f"{_date(500)},3,75.15517382051522,10",
+        f"{_date(400)},3,75.15517382051522,10",
+        f"{_date(300)},3,75.15517382051522,10",
+        f"{_date(200)},3,75.15517382051522,10",
+        f"{_date(100)},2,100.0,5",
+    ]
+    assert _read_csv(os.path.join(files_history_directory, "old.csv")) == [
+        HEADER,
+        f"{_date(300)},1,100.0,2",
+        f"{_date(200)},1,100.0,2",
+        f"{_date(100)},1,100.0,2",
+    ]
+
+    # Files with the same name in different directories share their history
+    assert _read_csv(os.path.join(files_history_directory, "util.csv")) == [
+        HEADER,
+        *(
+            row
+            for offset in (250, 500, 400, 300, 200, 100)
+            for row in (
+                f"{_date(offset)},3,74.61162467590292,6",
+                f"{_date(offset)},1,88.5574946685516,2",
+            )
+        ),
+    ]
+
+
+def test_inspect_project_with_max_history_count(project_directory, tmp_path):
+    output_directory = _inspect(
+        project_directory,
+        tmp_path / "output",
+        inspect_history=True,
+        max_history_count=1,
+    )
+    files_history_directory = os.path.join(output_directory, "files_history")
+
+    # Only HEAD is inspected, although its parents have later dates
+    assert _read_csv(os.path.join(output_directory, "history_metrics.csv")) == [
+        HEADER,
+        f"{_date(250)},2.6363636363636362,80.74256707262148,22",
+    ]
+    assert sorted(os.listdir(files_history_directory)) == [
+        "feature.csv",
+        "main.csv",
+        "util.csv",
+    ]
+    assert _read_csv(os.path.join(files_history_directory, "util.csv")) == [
+        HEADER,
+        f"{_date(250)},3,74.61162467590292,6",
+        f"{_date(250)},1,88.5574946685516,2",
+    ]